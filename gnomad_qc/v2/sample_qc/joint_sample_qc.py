@@ -132,7 +132,7 @@ def run_assign_population_pcs(pop_pc_table: hl.Table, outfile: str, picklefile:
     if not fit:
         # Pickle RF
         with hl.hadoop_open(picklefile, 'wb') as out:
-            pickle.dump(pop_clf, out)
+            out.write(pickle.dumps(pop_clf))
 
     with hl.hadoop_open(outfile, 'w') as out:
         pop_df.to_csv(out, sep="\t", na_rep="NA", index=False)
@@ -1,6 +1,6 @@
 from gnomad.utils.slack import try_slack
 from gnomad_qc.v2.resources.variant_qc import *
-import copy
+import functools
 import itertools
 import argparse
 import sys
@@ -12,6 +12,15 @@ logger.setLevel(logging.INFO)
 
 HISTS = ['gq_hist_alt', 'gq_hist_all', 'dp_hist_alt', 'dp_hist_all', 'ab_hist_alt']
 
+# Frequency array fields unfurled into INFO, as (INFO label, struct field) pairs
+FREQ_FIELDS = [('AC', 'AC'), ('AN', 'AN'), ('AF', 'AF'), ('nhomalt', 'homozygote_count')]
+FAF_FIELDS = ['faf95', 'faf99']
+
+# INFO annotations exported under their original names
+ALLELE_INFO_FIELDS = ['BaseQRankSum', 'ClippingRankSum', 'DP', 'VQSLOD']
+REGION_FLAG_FIELDS = ['segdup', 'lcr', 'decoy', 'nonpar']
+ALLELE_TYPE_FIELDS = ['variant_type', 'allele_type', 'n_alt_alleles', 'was_mixed', 'has_star']
+
 GROUPS = ['adj', 'raw']
 SEXES = ['male', 'female']
 POPS = ['afr', 'amr', 'asj', 'eas', 'fin', 'nfe', 'oth', 'sas']
@@ -21,6 +30,13 @@ EAS_SUBPOPS = ['kor', 'oea', 'jpn']
 
 SORT_ORDER = ['popmax', 'group', 'pop', 'subpop', 'sex']
 
+# Label groupings of the frequency and filtering allele frequency annotations described in the VCF header;
+# these are the same for every gnomAD subset
+LABEL_GROUPS = [dict(group=GROUPS), dict(group=GROUPS, sex=SEXES), dict(group=GROUPS, pop=POPS),
+                dict(group=GROUPS, pop=POPS, sex=SEXES), dict(group=GROUPS, pop=['nfe'], subpop=NFE_SUBPOPS),
+                dict(group=GROUPS, pop=['eas'], subpop=EAS_SUBPOPS)]
+FAF_LABEL_GROUPS = [dict(group=['adj']), dict(group=['adj'], pop=FAF_POPS)]
+
 INFO_DICT = {
     'FS': {"Description": "Phred-scaled p-value of Fisher's exact test for strand bias"},
     'InbreedingCoeff': {
@@ -109,15 +125,21 @@ def make_label_combos(label_groups: Dict[str, List[str]]) -> List[str]:
     :return: list of all possible combinations of values for the supplied label groupings
     :rtype: list[str]
     '''
-    copy_label_groups = copy.deepcopy(label_groups)
-    if len(copy_label_groups) == 1:
-        return [item for sublist in copy_label_groups.values() for item in sublist]
-    anchor_group = sorted(copy_label_groups.keys(), key=lambda x: SORT_ORDER.index(x))[0]
-    anchor_val = copy_label_groups.pop(anchor_group)
-    combos = []
-    for x,y in itertools.product(anchor_val, make_label_combos(copy_label_groups)):
-        combos.append('{0}_{1}'.format(x,y))
-    return combos
+    return list(_make_label_combos(tuple((k, tuple(v)) for k, v in label_groups.items())))
+
+
+@functools.lru_cache(maxsize=None)
+def _make_label_combos(label_groups: Tuple[Tuple[str, Tuple[str, ...]], ...]) -> Tuple[str, ...]:
+    '''
+    Cached implementation of make_label_combos; label groups are supplied as hashable (grouping, values) pairs so that
+    combinations shared by every gnomAD subset are only built once
+    :param tuple label_groups: Tuple of (grouping name, tuple of grouping values) pairs
+    :return: Tuple of all possible combinations of values for the supplied label groupings
+    :rtype: tuple of str
+    '''
+    label_values = dict(label_groups)
+    group_types = sorted(label_values.keys(), key=lambda x: SORT_ORDER.index(x))
+    return tuple('_'.join(combo) for combo in itertools.product(*(label_values[group] for group in group_types)))
 
 
 def make_info_expr(ht: hl.Table) -> Dict[str, hl.expr.Expression]:
@@ -137,34 +159,25 @@ def make_info_expr(ht: hl.Table) -> Dict[str, hl.expr.Expression]:
         'SOR': ht.info_SOR,
         'VQSR_POSITIVE_TRAIN_SITE': ht.info_POSITIVE_TRAIN_SITE,
         'VQSR_NEGATIVE_TRAIN_SITE': ht.info_NEGATIVE_TRAIN_SITE,
-        'BaseQRankSum': ht.allele_info.BaseQRankSum,
-        'ClippingRankSum': ht.allele_info.ClippingRankSum,
-        'DP': ht.allele_info.DP,
-        'VQSLOD': ht.allele_info.VQSLOD,
+        **ht.allele_info.select(*ALLELE_INFO_FIELDS),
         'VQSR_culprit': ht.allele_info.culprit,
-        'segdup': ht.segdup,
-        'lcr': ht.lcr,
-        'decoy': ht.decoy,
-        'nonpar': ht.nonpar,
+        **ht.row.select(*REGION_FLAG_FIELDS),
         'rf_positive_label': ht.tp,
         'rf_negative_label': ht.fail_hard_filters,
         'rf_label': ht.rf_label,
         'rf_train': ht.rf_train,
         'rf_tp_probability': ht.rf_probability,
         'transmitted_singleton': ht.transmitted_singleton,
-        'variant_type': ht.variant_type,
-        'allele_type': ht.allele_type,
-        'n_alt_alleles': ht.n_alt_alleles,
-        'was_mixed': ht.was_mixed,
-        'has_star': ht.has_star,
+        **ht.row.select(*ALLELE_TYPE_FIELDS),
         'pab_max': ht.pab_max,
     }
     for hist in HISTS:
+        hist_expr = ht[hist]
         hist_dict = {
-            f'{hist}_bin_freq': hl.delimit(ht[hist].bin_freq, delimiter="|"),
-            f'{hist}_bin_edges': hl.delimit(ht[hist].bin_edges, delimiter="|"),
-            f'{hist}_n_smaller': ht[hist].n_smaller,
-            f'{hist}_n_larger': ht[hist].n_larger
+            hist + '_bin_freq': hl.delimit(hist_expr.bin_freq, delimiter="|"),
+            hist + '_bin_edges': hl.delimit(hist_expr.bin_edges, delimiter="|"),
+            hist + '_n_smaller': hist_expr.n_smaller,
+            hist + '_n_larger': hist_expr.n_larger
         }
         info_dict.update(hist_dict)
     return info_dict
@@ -203,11 +216,12 @@ def sample_sum_check(ht: hl.Table, prefix: str, label_groups: Dict[str, List[str
     :param str subpop: Subpop abbreviation, supplied only if subpopulations are included in the annotation groups being checked
     :rtype: None
     '''
-    combo_AC = [ht.info[f'{prefix}_AC_{x}'] for x in make_label_combos(label_groups)]
-    combo_AN = [ht.info[f'{prefix}_AN_{x}'] for x in make_label_combos(label_groups)]
-    combo_nhomalt = [ht.info[f'{prefix}_nhomalt_{x}'] for x in make_label_combos(label_groups)]
-    group = label_groups.pop('group')[0]
-    alt_groups = "_".join(sorted(label_groups.keys(), key=lambda x: SORT_ORDER.index(x)))
+    combos = make_label_combos(label_groups)
+    combo_AC = [ht.info[f'{prefix}_AC_{x}'] for x in combos]
+    combo_AN = [ht.info[f'{prefix}_AN_{x}'] for x in combos]
+    combo_nhomalt = [ht.info[f'{prefix}_nhomalt_{x}'] for x in combos]
+    group = label_groups['group'][0]
+    alt_groups = "_".join(sorted((x for x in label_groups if x != 'group'), key=lambda x: SORT_ORDER.index(x)))
 
     annot_dict = {f'sum_AC_{group}_{alt_groups}': hl.sum(combo_AC),
                   f'sum_AN_{group}_{alt_groups}': hl.sum(combo_AN),
@@ -438,73 +452,81 @@ def index_globals(freq_meta, label_groups):
     return index_dict
 
 
-def unfurl_nested_annotations(ht):
+def eval_globals(ht: hl.Table) -> hl.Struct:
+    '''
+    Evaluate the global annotations needed to build the release VCF INFO and FILTER fields in a single Hail evaluation
+    :param Table ht: Release Table containing the frequency, faf, and popmax index dictionaries and the random forest cutoffs
+    :return: Struct containing the evaluated index dictionaries and the random forest SNP and indel cutoffs
+    :rtype: Struct
+    '''
+    return hl.eval(hl.struct(freq_index_dict=ht.globals.freq_index_dict,
+                             faf_index_dict=ht.globals.faf_index_dict,
+                             popmax_index_dict=ht.globals.popmax_index_dict,
+                             snv_cutoff=ht.globals.rf.rf_snv_cutoff.min_score,
+                             indel_cutoff=ht.globals.rf.rf_indel_cutoff.min_score))
+
+
+def parse_index_key(key):
+    '''
+    Split a key of the freq or faf index dictionaries into its gnomAD subset prefix and its label combination
+    :param str key: Index dictionary key, e.g. "gnomad_afr_male" or "non_neuro_raw"
+    :return: Subset prefix and label combination, where groupings other than 'raw' are labelled 'adj'
+    :rtype: (str, str)
+    '''
+    entry = key.split("_")
+    n_prefix = 2 if entry[0] == "non" else 1
+    combo_fields = ['adj'] + entry[n_prefix:]
+    if combo_fields == ['adj', 'raw']:
+        combo_fields = ['raw']
+    return "_".join(entry[:n_prefix]), "_".join(combo_fields)
+
+
+def unfurl_nested_annotations(ht, freq_idx, faf_idx, popmax_idx):
     '''
     Create dictionary keyed by the variant annotation labels to be extracted from variant annotation arrays, where the values
     of the dictionary are Hail Expressions describing how to access the corresponding values
     :param Table ht: Hail Table containing the nested variant annotation arrays to be unfurled
+    :param dict freq_idx: Evaluated freq_index_dict global annotation of ht
+    :param dict faf_idx: Evaluated faf_index_dict global annotation of ht
+    :param dict popmax_idx: Evaluated popmax_index_dict global annotation of ht
     :return: Dictionary containing variant annotations and their corresponding values
     :rtype: Dict of str: Expression
     '''
-    expr_dict = dict()
-
-    for k, i in hl.eval(ht.globals.freq_index_dict).items():
-        entry = k.split("_")
-        if entry[0] == "non":
-            prefix = "_".join(entry[:2])
-            combo_fields = ['adj'] + entry[2:]
-            if combo_fields == ['adj', 'raw']:
-                combo_fields = ['raw']
-        else:
-            prefix = entry[0]
-            combo_fields = ['adj'] + entry[1:]
-            if combo_fields == ['adj', 'raw']:
-                combo_fields = ['raw']
-        combo = "_".join(combo_fields)
+    # Index each array entry once and project all of its fields from the same element expression
+    freq_combos = [(*parse_index_key(k), ht.freq[i]) for k, i in freq_idx.items()]
+    expr_dict = {f"{prefix}_{field}_{combo}": freq_expr[attr]
+                 for prefix, combo, freq_expr in freq_combos for field, attr in FREQ_FIELDS}
+
+    faf_combos = []
+    for k, i in faf_idx.items():  # NOTE: faf annotations are all done on adj-only groupings
+        prefix, combo = parse_index_key(k)
+        faf_expr = ht.faf[i]
+        faf_combos.append((prefix, combo, hl.or_missing(hl.set(faf_expr.meta.values()) == set(combo.split("_")), faf_expr)))
+    expr_dict.update({f"{prefix}_{field}_{combo}": faf_expr[field]
+                      for prefix, combo, faf_expr in faf_combos for field in FAF_FIELDS})
+
+    for prefix, i in popmax_idx.items():
+        popmax_expr = ht.popmax[i]
         combo_dict = {
-            f"{prefix}_AC_{combo}": ht.freq[i].AC,
-            f"{prefix}_AN_{combo}": ht.freq[i].AN,
-            f"{prefix}_AF_{combo}": ht.freq[i].AF,
-            f"{prefix}_nhomalt_{combo}": ht.freq[i].homozygote_count
-        }
-        expr_dict.update(combo_dict)
-
-    for k, i in hl.eval(ht.globals.faf_index_dict).items():  # NOTE: faf annotations are all done on adj-only groupings
-        entry = k.split("_")
-        if entry[0] == "non":
-            prefix = "_".join(entry[:2])
-            combo_fields = ['adj'] + entry[2:]
-        else:
-            prefix = entry[0]
-            combo_fields = ['adj'] + entry[1:]
-        combo = "_".join(combo_fields)
-        combo_dict = {
-            f"{prefix}_faf95_{combo}": hl.or_missing(hl.set(ht.faf[i].meta.values()) == set(combo_fields),
-                                                     ht.faf[i].faf95),
-            f"{prefix}_faf99_{combo}": hl.or_missing(hl.set(ht.faf[i].meta.values()) == set(combo_fields),
-                                                     ht.faf[i].faf99),
-        }
-        expr_dict.update(combo_dict)
-
-    for prefix, i in hl.eval(ht.globals.popmax_index_dict).items():
-        combo_dict = {
-            f'{prefix}_popmax': ht.popmax[i].pop,
-            f'{prefix}_AC_popmax': ht.popmax[i].AC,
-            f'{prefix}_AN_popmax': ht.popmax[i].AN,
-            f'{prefix}_AF_popmax': ht.popmax[i].AF,
-            f'{prefix}_nhomalt_popmax': ht.popmax[i].homozygote_count,
+            prefix + '_popmax': popmax_expr.pop,
+            prefix + '_AC_popmax': popmax_expr.AC,
+            prefix + '_AN_popmax': popmax_expr.AN,
+            prefix + '_AF_popmax': popmax_expr.AF,
+            prefix + '_nhomalt_popmax': popmax_expr.homozygote_count,
         }
         expr_dict.update(combo_dict)
         if prefix == 'gnomad':
+            age_hist_het = ht.age_hist_het[i]
+            age_hist_hom = ht.age_hist_hom[i]
             age_hist_dict = {
-                f"{prefix}_age_hist_het_bin_freq": hl.delimit(ht.age_hist_het[i].bin_freq, delimiter="|"),
-                f"{prefix}_age_hist_het_bin_edges": hl.delimit(ht.age_hist_het[i].bin_edges, delimiter="|"),
-                f"{prefix}_age_hist_het_n_smaller": ht.age_hist_het[i].n_smaller,
-                f"{prefix}_age_hist_het_n_larger": ht.age_hist_het[i].n_larger,
-                f"{prefix}_age_hist_hom_bin_freq": hl.delimit(ht.age_hist_hom[i].bin_freq, delimiter="|"),
-                f"{prefix}_age_hist_hom_bin_edges": hl.delimit(ht.age_hist_hom[i].bin_edges, delimiter="|"),
-                f"{prefix}_age_hist_hom_n_smaller": ht.age_hist_hom[i].n_smaller,
-                f"{prefix}_age_hist_hom_n_larger": ht.age_hist_hom[i].n_larger
+                prefix + "_age_hist_het_bin_freq": hl.delimit(age_hist_het.bin_freq, delimiter="|"),
+                prefix + "_age_hist_het_bin_edges": hl.delimit(age_hist_het.bin_edges, delimiter="|"),
+                prefix + "_age_hist_het_n_smaller": age_hist_het.n_smaller,
+                prefix + "_age_hist_het_n_larger": age_hist_het.n_larger,
+                prefix + "_age_hist_hom_bin_freq": hl.delimit(age_hist_hom.bin_freq, delimiter="|"),
+                prefix + "_age_hist_hom_bin_edges": hl.delimit(age_hist_hom.bin_edges, delimiter="|"),
+                prefix + "_age_hist_hom_n_smaller": age_hist_hom.n_smaller,
+                prefix + "_age_hist_hom_n_larger": age_hist_hom.n_larger
             }
             expr_dict.update(age_hist_dict)
     return expr_dict
@@ -629,11 +651,12 @@ def make_hist_bin_edges_expr(ht):
     :return: Dictionary keyed by histogram annotation name, with corresponding reformatted bin edges for values
     :rtype: Dict of str: str
     '''
-    edges_dict = {'gnomad_het': '|'.join(map(lambda x: f'{x:.1f}', ht.take(1)[0].age_hist_het[0].bin_edges)),
-                  'gnomad_hom': '|'.join(map(lambda x: f'{x:.1f}', ht.take(1)[0].age_hist_hom[0].bin_edges))}
+    row = ht.take(1)[0]
+    edges_dict = {'gnomad_het': '|'.join(map(lambda x: f'{x:.1f}', row.age_hist_het[0].bin_edges)),
+                  'gnomad_hom': '|'.join(map(lambda x: f'{x:.1f}', row.age_hist_hom[0].bin_edges))}
     for hist in HISTS:
-        edges_dict[hist] = '|'.join(map(lambda x: f'{x:.2f}', ht.take(1)[0][hist].bin_edges)) if 'ab' in hist else \
-            '|'.join(map(lambda x: str(int(x)), ht.take(1)[0][hist].bin_edges))
+        edges_dict[hist] = '|'.join(map(lambda x: f'{x:.2f}', row[hist].bin_edges)) if 'ab' in hist else \
+            '|'.join(map(lambda x: str(int(x)), row[hist].bin_edges))
     return edges_dict
 
 
@@ -663,19 +686,53 @@ def make_hist_dict(bin_edges):
     return header_hist_dict
 
 
-def make_filter_dict(ht):
+def make_vcf_info_key(key):
+    '''
+    Remove the 'gnomad_' and '_adj' tags used in internal variant annotation labels, to match the annotation names in the exported VCF
+    :param str key: Internal variant annotation label, e.g. "gnomad_AC_adj_afr"
+    :return: Variant annotation label used in the VCF, e.g. "AC_afr"
+    :rtype: str
+    '''
+    if 'gnomad_' in key or '_adj' in key:
+        return key.replace('gnomad_', '').replace('_adj', '')
+    return key
+
+
+def populate_info_dict(subset_list, bin_edges, age_hist_data):
+    '''
+    Generate dictionary of Number and Description attributes for all VCF INFO annotations, with 'gnomad_' and '_adj'
+    tags removed from the keys to match the annotation names in the exported VCF
+    :param list of str subset_list: List of gnomAD subsets to include in the VCF header
+    :param dict bin_edges: Dictionary keyed by annotation type, with values that reflect the bin edges corresponding to the annotation
+    :param list of int age_hist_data: Background distribution of ages among release samples, from get_age_distributions
+    :return: Dictionary keyed by VCF INFO annotations, where values are Dictionaries of Number and Description attributes
+    :rtype: Dict of str: (Dict of str: str)
+    '''
+    vcf_info_dict = INFO_DICT.copy()
+    age_hist_str = '|'.join(map(str, age_hist_data))
+    # NOTE: keys are renamed as they are inserted; INFO_DICT and histogram keys carry no gnomad or adj tags
+    for subset in subset_list:
+        info_dicts = [make_info_dict(subset, bin_edges=bin_edges, popmax=True, age_hist_data=age_hist_str)]
+        info_dicts.extend(make_info_dict(subset, label_group) for label_group in LABEL_GROUPS)
+        info_dicts.extend(make_info_dict(subset, label_group, faf=True) for label_group in FAF_LABEL_GROUPS)
+        for info_dict in info_dicts:
+            vcf_info_dict.update((make_vcf_info_key(i), j) for i, j in info_dict.items())
+    vcf_info_dict.update(make_hist_dict(bin_edges))
+    return vcf_info_dict
+
+
+def make_filter_dict(snp_cutoff, indel_cutoff):
     '''
     Generate dictionary of Number and Description attributes to be used in the VCF header, specifically for FILTER annotations
-    :param Table ht: Table containing global annotations of the Random Forests SNP and indel cutoffs
+    :param float snp_cutoff: Random Forests minimum probability score for SNPs
+    :param float indel_cutoff: Random Forests minimum probability score for indels
     :return: Dictionary keyed by VCF FILTER annotations, where values are Dictionaries of Number and Description attributes
     :rtype: Dict of str: (Dict of str: str)
     '''
-    snp_cutoff = hl.eval(ht.globals.rf.rf_snv_cutoff)
-    indel_cutoff = hl.eval(ht.globals.rf.rf_indel_cutoff)
     filter_dict = {
         'AC0': {'Description': 'Allele count is zero after filtering out low-confidence genotypes (GQ < 20; DP < 10; and AB < 0.2 for het calls)'},
         'InbreedingCoeff': {'Description': 'InbreedingCoeff < -0.3'},
-        'RF': {'Description': 'Failed random forest filtering thresholds of {0}, {1} (probabilities of being a true positive variant) for SNPs, indels'.format(snp_cutoff.min_score, indel_cutoff.min_score)},
+        'RF': {'Description': 'Failed random forest filtering thresholds of {0}, {1} (probabilities of being a true positive variant) for SNPs, indels'.format(snp_cutoff, indel_cutoff)},
         'PASS': {'Description': 'Passed all variant filters'}
     }
     return filter_dict
@@ -694,22 +751,21 @@ def make_index_dict(ht):
     return index_dict
 
 
-def set_female_y_metrics_to_na(ht):
+def set_female_y_metrics_to_na(ht, info_dict):
     '''
     Set AC, AN, and nhomalt Y variant annotations for females to NA (instead of 0)
-    :param Table ht: Hail Table containing female variant annotations
-    :return: Table with reset annotations
-    :rtype: Table
+    :param Table ht: Hail Table containing the variants to be annotated
+    :param dict info_dict: Dictionary containing Hail expressions for INFO annotations, including female variant annotations
+    :return: Dictionary containing Hail expressions for INFO annotations, with reset female annotations
+    :rtype: Dict of str: Expression
     '''
-    metrics = list(ht.row.info)
-    female_metrics = [x for x in metrics if '_female' in x]
+    female_metrics = [x for x in info_dict if '_female' in x]
     female_metrics = [x for x in female_metrics if ('nhomalt' in x) or ('AC' in x) or ('AN' in x)]
 
     female_metrics_dict = {}
     for metric in female_metrics:
-        female_metrics_dict.update({f'{metric}': hl.cond(ht.locus.contig == 'Y', hl.null(hl.tint32), ht.info[f'{metric}'])})
-    ht = ht.annotate(info=ht.info.annotate(**female_metrics_dict))
-    return ht
+        female_metrics_dict.update({f'{metric}': hl.cond(ht.locus.contig == 'Y', hl.null(hl.tint32), info_dict[f'{metric}'])})
+    return {**info_dict, **female_metrics_dict}
 
 
 def get_array_lengths(ht, subsets):
@@ -762,13 +818,12 @@ def concat_array_expr(ht, subsets, field):
     :return: Hail Expression to concatenate specified variant annotations across a list of subsets
     :rtype: Expression
     '''
-    copy_subsets = copy.deepcopy(subsets)
-    subset = copy_subsets.pop()
+    *other_subsets, subset = subsets
 
-    if len(copy_subsets) == 0:
+    if len(other_subsets) == 0:
         expr = ht[field].extend(ht[subset][field])
     else:
-        expr = concat_array_expr(ht, copy_subsets, field).extend(ht[subset][field])
+        expr = concat_array_expr(ht, other_subsets, field).extend(ht[subset][field])
     return expr
 
 
@@ -782,13 +837,12 @@ def concat_struct_expr(ht, subsets, field):
     :return: Hail Expression to concatenate specified variant annotations across a list of subsets
     :rtype: Expression
     '''
-    copy_subsets = copy.deepcopy(subsets)
-    subset = copy_subsets.pop()
+    *other_subsets, subset = subsets
 
-    if len(copy_subsets) == 0:
+    if len(other_subsets) == 0:
         expr = hl.array([ht[field]]).extend(hl.array([ht[subset][field]]))
     else:
-        expr = concat_struct_expr(ht, copy_subsets, field).extend(hl.array([ht[subset][field]]))
+        expr = concat_struct_expr(ht, other_subsets, field).extend(hl.array([ht[subset][field]]))
     return expr
 
 
@@ -894,8 +948,8 @@ def main(args):
     if args.add_subset_frequencies:
         ht = hl.read_table(release_ht_path(data_type, with_subsets=False))
         controls_ht = hl.read_table(annotations_ht_path(data_type, 'frequencies_control_with_consanguineous'))  # FIXME: revert to plain 'frequencies' for v3+
-        freq_index_dict = make_index_dict(controls_ht)
-        print(hl.eval(controls_ht.freq_meta))
+        if args.verbose:
+            print(hl.eval(controls_ht.freq_meta))
         controls_ht = controls_ht.drop('helloworld')
 
         non_neuro_ht = hl.read_table(annotations_ht_path(data_type, 'frequencies_neuro_with_consanguineous'))  # FIXME: revert to plain 'frequencies' for v3+
@@ -944,6 +998,7 @@ def main(args):
 
     if args.prepare_release_vcf:
         ht = hl.read_table(import_ht_path)
+        release_globals = eval_globals(ht)
         bin_edges = make_hist_bin_edges_expr(ht)
 
         # Make INFO dictionary for VCF
@@ -951,29 +1006,14 @@ def main(args):
             subset_list = ['gnomad', 'controls', 'non_neuro', 'non_cancer', 'non_topmed'] if args.include_subset_frequencies else ['gnomad']
         else:
             subset_list = ['gnomad', 'controls', 'non_neuro', 'non_topmed'] if args.include_subset_frequencies else ['gnomad']
-        for subset in subset_list:
-            INFO_DICT.update(make_info_dict(subset, bin_edges=bin_edges, popmax=True,
-                                            age_hist_data='|'.join(str(x) for x in age_hist_data)))
-            INFO_DICT.update(make_info_dict(subset, dict(group=GROUPS)))
-            INFO_DICT.update(make_info_dict(subset, dict(group=GROUPS, sex=SEXES)))
-            INFO_DICT.update(make_info_dict(subset, dict(group=GROUPS, pop=POPS)))
-            INFO_DICT.update(make_info_dict(subset, dict(group=GROUPS, pop=POPS, sex=SEXES)))
-            INFO_DICT.update(make_info_dict(subset, dict(group=GROUPS, pop=['nfe'], subpop=NFE_SUBPOPS)))
-            INFO_DICT.update(make_info_dict(subset, dict(group=GROUPS, pop=['eas'], subpop=EAS_SUBPOPS)))
-            INFO_DICT.update(make_info_dict(subset, dict(group=['adj']), faf=True))
-            INFO_DICT.update(make_info_dict(subset, dict(group=['adj'], pop=FAF_POPS), faf=True))
-        INFO_DICT.update(make_hist_dict(bin_edges))
-
-        # Adjust keys to remove gnomad, adj tags before exporting to VCF
-        new_info_dict = {i.replace('gnomad_', '').replace('_adj', ''): j for i,j in INFO_DICT.items()}
-
-        # Construct INFO field
-        ht = ht.annotate(info=hl.struct(**make_info_expr(ht)))
-        ht = ht.annotate(info=ht.info.annotate(**unfurl_nested_annotations(ht)))
-        ht = set_female_y_metrics_to_na(ht)
-
-        # Select relevant fields for VCF export
-        ht = ht.select('info', 'filters', 'rsid', 'qual', 'vep')
+        new_info_dict = populate_info_dict(subset_list, bin_edges, age_hist_data)
+
+        # Construct INFO field and select relevant fields for VCF export in a single projection, so that source
+        # annotations not used in the release (e.g., per-subset structs) are never carried through the pipeline
+        info_expr = {**make_info_expr(ht), **unfurl_nested_annotations(ht, release_globals.freq_index_dict,
+                                                                       release_globals.faf_index_dict,
+                                                                       release_globals.popmax_index_dict)}
+        ht = ht.select('filters', 'rsid', 'qual', 'vep', info=hl.struct(**set_female_y_metrics_to_na(ht, info_expr)))
         ht.write(release_ht_path(data_type, nested=False, temp=True), args.overwrite)
 
         # Move 'info' annotations to top level for browser release
@@ -984,11 +1024,11 @@ def main(args):
 
         # Remove gnomad_ prefix for VCF export
         ht = hl.read_table(release_ht_path(data_type, nested=False, temp=True))
-        contigs = hl.eval(ht.aggregate(hl.agg.collect_as_set(ht.locus.contig)))
+        contigs = ht.aggregate(hl.agg.collect_as_set(ht.locus.contig))
 
         ht = ht.drop('vep')
         row_annots = list(ht.row.info)
-        new_row_annots = [x.replace('gnomad_', '').replace('_adj', '') for x in row_annots]
+        new_row_annots = [make_vcf_info_key(x) for x in row_annots]
         info_annot_mapping = dict(zip(new_row_annots, [ht.info[f'{x}'] for x in row_annots]))
         ht = ht.transmute(info=hl.struct(**info_annot_mapping))
 
@@ -999,9 +1039,9 @@ def main(args):
 
         # Add VEP annotations
         vep_csq_ht = hl.read_table(annotations_ht_path(data_type, 'vep_csq'))
-        new_info_dict.update({'vep': {'Description': hl.eval(vep_csq_ht.globals.vep_csq_header)}})
+        new_info_dict['vep'] = {'Description': hl.eval(vep_csq_ht.globals.vep_csq_header)}
         header_dict = {'info': new_info_dict,
-                       'filter': make_filter_dict(ht)}
+                       'filter': make_filter_dict(release_globals.snv_cutoff, release_globals.indel_cutoff)}
         ht = ht.annotate(info=ht.info.annotate(vep=vep_csq_ht[ht.key].vep))
 
         # Export VCFs, full and by chromosome
@@ -1020,7 +1060,7 @@ def main(args):
         # Export genome VCFs containing variants in exome calling intervals only
         if data_type == 'genomes':
             intervals = hl.import_locus_intervals(exome_calling_intervals_path, skip_invalid_intervals=True, reference_genome=gnomad_ref)
-            coding_mt = mt.filter_rows(hl.is_defined(intervals[mt.locus]), keep=True)
+            coding_mt = hl.filter_intervals(mt, intervals.interval.collect())
             hl.export_vcf(coding_mt, release_vcf_path(data_type, coding_only=True), metadata=header_dict)
 
     if args.sanity_check_sites:
@@ -1049,7 +1089,7 @@ if __name__ == '__main__':
     parser.add_argument('--prepare_release_vcf', help='Prepare release VCF', action='store_true')
     parser.add_argument('--sanity_check_sites', help='Run sanity checks function', action='store_true')
     parser.add_argument('--liftover', help='Liftover final sites file', action='store_true')
-    parser.add_argument('--verbose', help='Run sanity checks function with verbose output', action='store_true')
+    parser.add_argument('--verbose', help='Run sanity checks function with verbose output, and print subset frequency metadata when adding subset frequencies', action='store_true')
     parser.add_argument('--slack_channel', help='Slack channel to post results and notifications to.')
     parser.add_argument('--overwrite', help='Overwrite data', action='store_true')
     args = parser.parse_args()
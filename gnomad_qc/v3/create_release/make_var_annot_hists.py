@@ -17,11 +17,10 @@ def main(args):
     ht = hl.read_table(release_ht_path())
     # NOTE: histogram aggregations are done on the entire callset (not just PASS variants), on raw data
 
-    hist_dict = ANNOTATIONS_HISTS
-    hist_dict['MQ'] = (20, 60, 40) # Boundaries changed for v3, but could be a good idea to settle on a standard
+    hist_dict = {**ANNOTATIONS_HISTS, 'MQ': (20, 60, 40)} # Boundaries changed for v3, but could be a good idea to settle on a standard
     hist_ranges_expr = get_annotations_hists(
         ht,
-        ANNOTATIONS_HISTS
+        hist_dict
     )
 
     # NOTE: run the following code in a first pass to determine bounds for metrics
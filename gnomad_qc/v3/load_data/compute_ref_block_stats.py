@@ -54,7 +54,7 @@ def compute_stats(stats_path: str):
     )
 
     with hl.hadoop_open(stats_path, 'wb') as f:
-        pickle.dump(ref_block_stats, f)
+        f.write(pickle.dumps(ref_block_stats))
 
 
 def main(args):
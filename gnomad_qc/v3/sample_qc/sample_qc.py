@@ -480,7 +480,7 @@ def main(args):
         ).export(pop_tsv_path)
 
         with hl.hadoop_open(pop_rf_path, 'wb') as out:
-            pickle.dump(pops_rf_model, out)
+            out.write(pickle.dumps(pops_rf_model))
 
     if args.calculate_inbreeding:
         qc_mt = qc.mt()